@@ -30,6 +30,11 @@ st.set_page_config(
 # [Security] 生产环境请修改密钥
 SECRET_KEY = "CenturyCity_V32_Ultimate_Secret_!@#"
 DB_FILE = "property_core.db"
+MASTER_PAGE_SIZE = 50  # 基础档案编辑器每页行数
+ARCHIVE_DB_FILE = "property_archive.db"  # 冷数据归档库 (ATTACH 为 arch)
+ARCHIVE_KEEP_DAYS = 730  # 默认保留最近两年热数据
+ARCHIVE_BATCH_SIZE = 500  # 每批归档行数，批间释放写锁
+ARCHIVE_TABLES = ["ledger", "trans_log", "audit_logs"]
 
 # ==============================================================================
 # 1. 数据库层 (Database Layer)
@@ -40,6 +45,36 @@ def get_connection():
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
+def get_archive_connection():
+    """
+    [Archive] 挂载归档库 arch，并创建冷热合并的临时视图:
+    ledger_all / trans_log_all / audit_logs_all (仅用于历史查询与导出)
+    """
+    init_archive_db()
+    conn = get_connection()
+    conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_DB_FILE,))
+    for table in ARCHIVE_TABLES:
+        conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {table}_all AS SELECT * FROM main.{table} UNION ALL SELECT * FROM arch.{table}")
+    return conn
+
+@st.cache_resource
+def init_archive_db():
+    """
+    [Archive] 在归档库中按热表原始 DDL (含主键) 建表，合并视图中不会出现重复 ID
+    首次使用归档功能时执行，每个进程只执行一次 (依赖 init_db 已建好热表)
+    """
+    conn = get_connection()
+    conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_DB_FILE,))
+    for table in ARCHIVE_TABLES:
+        ddl = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+        conn.execute(ddl.replace(f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS arch.{table}", 1))
+    conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_ledger_room ON ledger (room_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_trans_room ON trans_log (room_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_audit_time ON audit_logs (log_time)")
+    conn.commit()
+    conn.close()
+    return True
+
 def init_db():
     conn = get_connection()
     c = conn.cursor()
@@ -92,6 +127,19 @@ def init_db():
         detail TEXT
     )''')
 
+    # --- [Archive] 已归档账单汇总 (保证看板/BI 合计不因归档而减少) ---
+    c.execute('''CREATE TABLE IF NOT EXISTS ledger_archive_summary (
+        fee_type TEXT,
+        period TEXT,
+        receivable TEXT,
+        received TEXT,
+        waived TEXT,
+        bill_count INTEGER
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_summary ON ledger_archive_summary (fee_type, period)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_status_date ON ledger (status, charge_date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_logs (log_time)")
+
     # --- 基础档案表 ---
     c.execute('''CREATE TABLE IF NOT EXISTS master_units (
         room_id TEXT PRIMARY KEY,
@@ -111,6 +159,10 @@ def init_db():
         late_fee_rate TEXT
     )''')
 
+    # [Perf] 档案分页编辑: 按项目/状态过滤 + room_id 键集分页
+    c.execute("CREATE INDEX IF NOT EXISTS idx_units_project ON master_units (project, room_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_units_status ON master_units (status, room_id)")
+
     # --- [New in V32] 车位管理表 ---
     c.execute('''CREATE TABLE IF NOT EXISTS parking (
         spot_id TEXT PRIMARY KEY,
@@ -316,6 +368,145 @@ def save_master_data(table_name, df_edited, pk_col):
     finally:
         conn.close()
 
+def build_unit_filters(project=None, building=None, status=None):
+    """
+    [Perf] 房间档案过滤条件 -> (WHERE 子句列表, 参数列表)
+    楼栋取房号前缀 (如 1-101 -> 1)，转为 room_id 区间以命中主键索引
+    """
+    clauses, params = [], []
+    if project:
+        clauses.append("project = ?"); params.append(project)
+    if status:
+        clauses.append("status = ?"); params.append(status)
+    if building:
+        clauses.append("room_id >= ? AND room_id < ?")
+        params.extend([f"{building}-", f"{building}."])  # '.' 紧随 '-' 之后
+    return clauses, params
+
+def count_master_rows(table_name, clauses, params):
+    conn = get_connection()
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    total = conn.execute(f"SELECT count(*) FROM {table_name}{where}", params).fetchone()[0]
+    conn.close()
+    return total
+
+@st.cache_data(ttl=300)
+def load_unit_filter_options():
+    """
+    [Perf] 房间档案筛选项 (项目/状态)，DISTINCT 需扫描整个索引，故缓存；保存档案后清除
+    """
+    conn = get_connection()
+    projects = [r[0] for r in conn.execute("SELECT DISTINCT project FROM master_units WHERE project IS NOT NULL ORDER BY project")]
+    statuses = [r[0] for r in conn.execute("SELECT DISTINCT status FROM master_units WHERE status IS NOT NULL ORDER BY status")]
+    conn.close()
+    return projects, statuses
+
+def load_master_page(table_name, pk_col, clauses, params, after_key=None, page_size=MASTER_PAGE_SIZE):
+    """
+    [Perf] 键集分页读取基础档案: 只取 pk > after_key 的一页
+    多取一行用于判断是否存在下一页，返回 (df, has_next)
+    """
+    conn = get_connection()
+    conds = list(clauses); args = list(params)
+    if after_key is not None:
+        conds.append(f"{pk_col} > ?"); args.append(after_key)
+    where = f" WHERE {' AND '.join(conds)}" if conds else ""
+    df = pd.read_sql(f"SELECT * FROM {table_name}{where} ORDER BY {pk_col} LIMIT ?",
+                     conn, params=args + [page_size + 1])
+    conn.close()
+    has_next = len(df) > page_size
+    return df.head(page_size), has_next
+
+def archive_table_batches(conn, table_name, pk_col, where, params, batch_size, moved, on_batch=None, pause=0.05):
+    """
+    [Archive] 分批把 main.table 中满足条件的行搬到 arch.table
+    每批独立短事务 (BEGIN IMMEDIATE -> 复制 -> 删除 -> 提交)，批间让出写锁，避免阻塞收银
+    每批提交后累加 moved[table_name]，中途失败时调用方仍能得到已迁移行数
+    主键已存在于归档库的行 (短 ID 被新单据复用) 留在热表并跳过，返回跳过行数
+    on_batch(cursor, pks) 在同一事务内执行，用于维护汇总
+    """
+    cursor = conn.cursor()
+    in_arch = f"{pk_col} IN (SELECT {pk_col} FROM arch.{table_name})"
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"SELECT {pk_col} FROM main.{table_name} WHERE ({where}) AND NOT {in_arch} ORDER BY {pk_col} LIMIT ?",
+                           list(params) + [batch_size])
+            pks = [r[0] for r in cursor.fetchall()]
+            if not pks:
+                conn.rollback()
+                cursor.execute(f"SELECT count(*) FROM main.{table_name} WHERE ({where}) AND {in_arch}", list(params))
+                return cursor.fetchone()[0]
+            marks = ', '.join(['?'] * len(pks))
+            if on_batch: on_batch(cursor, pks)
+            cursor.execute(f"INSERT INTO arch.{table_name} SELECT * FROM main.{table_name} WHERE {pk_col} IN ({marks})", pks)
+            cursor.execute(f"DELETE FROM main.{table_name} WHERE {pk_col} IN ({marks})", pks)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved[table_name] += len(pks)
+        time.sleep(pause)
+
+def accumulate_archive_summary(cursor, uuids):
+    """
+    [Archive] 把即将归档的账单按 (费项, 期间) 累加进 ledger_archive_summary
+    """
+    marks = ', '.join(['?'] * len(uuids))
+    cursor.execute(f"SELECT fee_type, period, receivable, received, waived FROM main.ledger WHERE uuid IN ({marks})", uuids)
+    groups = {}
+    for fee_type, period, receivable, received, waived in cursor.fetchall():
+        g = groups.setdefault((fee_type, period), [Decimal('0.00'), Decimal('0.00'), Decimal('0.00'), 0])
+        g[0] += to_decimal(receivable); g[1] += to_decimal(received); g[2] += to_decimal(waived); g[3] += 1
+    for (fee_type, period), g in groups.items():
+        cursor.execute("SELECT rowid, receivable, received, waived, bill_count FROM ledger_archive_summary WHERE fee_type IS ? AND period IS ?",
+                       (fee_type, period))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE ledger_archive_summary SET receivable=?, received=?, waived=?, bill_count=? WHERE rowid=?",
+                           (str(to_decimal(row[1]) + g[0]), str(to_decimal(row[2]) + g[1]), str(to_decimal(row[3]) + g[2]), row[4] + g[3], row[0]))
+        else:
+            cursor.execute("INSERT INTO ledger_archive_summary VALUES (?,?,?,?,?,?)",
+                           (fee_type, period, str(g[0]), str(g[1]), str(g[2]), g[3]))
+
+def process_archive_history(cutoff_date, user, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    [Archive] 冷热分离: 将 cutoff_date 之前的已结清账单、流水与审计日志迁入归档库
+    待审批减免关联的账单保留在热表，避免审批时找不到账单
+    三张表各自独立归档，某张表失败不影响其余表
+    """
+    cutoff = str(cutoff_date)
+    jobs = [
+        ("ledger", "uuid",
+         "status IN ('已缴', '已结清(减免)') AND charge_date < ? "
+         "AND uuid NOT IN (SELECT ref_bill_id FROM main.waivers WHERE status='待审批' AND ref_bill_id IS NOT NULL)",
+         accumulate_archive_summary),
+        # 旧版充值流水未记录 trans_time，无法判断新旧，按历史数据一并归档
+        ("trans_log", "trans_id", "(trans_time < ? OR trans_time IS NULL)", None),
+        ("audit_logs", "log_id", "log_time < ?", None),
+    ]
+    moved = {table: 0 for table in ARCHIVE_TABLES}
+    skipped = {table: 0 for table in ARCHIVE_TABLES}
+    errors = []
+    conn = get_archive_connection()
+    try:
+        for table, pk_col, where, on_batch in jobs:
+            try:
+                skipped[table] = archive_table_batches(conn, table, pk_col, where, (cutoff,), batch_size, moved, on_batch=on_batch)
+            except Exception as e:
+                errors.append(f"{table}: {e}")
+    finally:
+        conn.close()
+    summary = f"账单 {moved['ledger']} 笔, 流水 {moved['trans_log']} 笔, 日志 {moved['audit_logs']} 条"
+    if any(skipped.values()):
+        summary += f"; ID 与归档库冲突而跳过: 账单 {skipped['ledger']}, 流水 {skipped['trans_log']}, 日志 {skipped['audit_logs']}"
+    if not errors:
+        db_log(user, "历史归档", f"截止 {cutoff}: {summary}")
+        return True, f"归档完成: {summary}"
+    err = "; ".join(errors)
+    db_log(user, "历史归档(中断)", f"截止 {cutoff}: 已迁移 {summary}; 错误: {err}")
+    return False, f"{err} (已迁移: {summary})"
+
 def process_payment_transaction(room, pay_list, pay_mode, total_pay_amt, user):
     conn = get_connection()
     cursor = conn.cursor()
@@ -380,6 +571,35 @@ def guest_view_sql(room):
         else: st.success("🎉 无待缴账单")
     else: st.info("暂无数据")
 
+def master_page_editor(table_name, pk_col, clauses, params, key, save_label):
+    """
+    [Perf] 分页版档案编辑器: 每次只加载/保存当前页，翻页游标存于 session_state
+    过滤条件变化时回到第一页
+    """
+    sig = (tuple(clauses), tuple(params))
+    if st.session_state.get(f"{key}_sig") != sig:
+        st.session_state[f"{key}_sig"] = sig
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+
+    total = count_master_rows(table_name, clauses, params)
+    df_page, has_next = load_master_page(table_name, pk_col, clauses, params, after_key=cursors[-1])
+    pages = max(1, -(-total // MASTER_PAGE_SIZE))
+    st.caption(f"共 {total} 条 | 第 {len(cursors)} / {pages} 页 (每页 {MASTER_PAGE_SIZE} 条)")
+
+    edited = st.data_editor(df_page, num_rows="dynamic", use_container_width=True, key=f"{key}_{len(cursors)}")
+    c1, c2, c3 = st.columns([1, 1, 2])
+    if c1.button("⬅️ 上一页", disabled=len(cursors) == 1, key=f"{key}_prev"):
+        cursors.pop(); st.rerun()
+    if c2.button("下一页 ➡️", disabled=not has_next, key=f"{key}_next"):
+        cursors.append(df_page[pk_col].iloc[-1]); st.rerun()
+    if c3.button(save_label, key=f"{key}_save"):
+        edited = edited[edited[pk_col].notna() & (edited[pk_col].astype(str).str.strip() != "")]
+        if save_master_data(table_name, edited, pk_col):
+            load_unit_filter_options.clear()
+            st.success("保存成功！"); time.sleep(1); st.rerun()
+        else: st.error("保存失败")
+
 # ==============================================================================
 # 3. 主程序
 # ==============================================================================
@@ -430,6 +650,7 @@ def main():
             "📨 减免审批",     # [New]
             "⚙️ 基础配置",  
             "📥 数据导入",  
+            "🗄️ 历史归档",     # [Archive]
             "🛡️ 审计日志"
         ])
         
@@ -450,11 +671,12 @@ def main():
         conn = get_connection()
         df_led = pd.read_sql("SELECT room_id, arrears, received FROM ledger", conn)
         df_wal = pd.read_sql("SELECT balance FROM wallet", conn)
+        df_arc = pd.read_sql("SELECT received FROM ledger_archive_summary", conn)
         conn.close()
         
         df_led['arrears'] = df_led['arrears'].apply(to_decimal)
         df_led['received'] = df_led['received'].apply(to_decimal)
-        total_inc = df_led['received'].sum()
+        total_inc = df_led['received'].sum() + df_arc['received'].apply(to_decimal).sum()
         total_arr = df_led[df_led['arrears'] > 0]['arrears'].sum()
         df_wal['balance'] = df_wal['balance'].apply(to_decimal)
         total_pool = df_wal['balance'].sum()
@@ -472,11 +694,16 @@ def main():
         else:
             conn = get_connection()
             # 1. 收入构成分析
-            df_fee = pd.read_sql("SELECT fee_type, SUM(received) as total FROM ledger GROUP BY fee_type", conn)
+            # [Archive] 合并已归档汇总，保证历史合计不变
+            df_fee = pd.read_sql("""SELECT fee_type, SUM(received) as total FROM (
+                SELECT fee_type, received FROM ledger UNION ALL SELECT fee_type, received FROM ledger_archive_summary
+            ) GROUP BY fee_type""", conn)
             df_fee['total'] = df_fee['total'].apply(float) # Plotly needs float
             
             # 2. 月度收费趋势
-            df_trend = pd.read_sql("SELECT period, SUM(received) as total FROM ledger GROUP BY period ORDER BY period", conn)
+            df_trend = pd.read_sql("""SELECT period, SUM(received) as total FROM (
+                SELECT period, received FROM ledger UNION ALL SELECT period, received FROM ledger_archive_summary
+            ) GROUP BY period ORDER BY period""", conn)
             df_trend['total'] = df_trend['total'].apply(float)
             conn.close()
             
@@ -583,24 +810,21 @@ def main():
     elif nav == "⚙️ 基础配置":
         st.title("⚙️ 基础档案配置 (Master Data)")
         t1, t2 = st.tabs(["🏠 房间档案", "💰 收费标准"])
-        conn = get_connection()
         with t1:
-            st.caption("直接修改下方表格，点击保存同步至数据库。")
-            df_units = pd.read_sql("SELECT * FROM master_units", conn)
-            edited_units = st.data_editor(df_units, num_rows="dynamic", use_container_width=True, key="ed_u")
-            if st.button("💾 保存房间档案"):
-                if save_master_data("master_units", edited_units, "room_id"):
-                    st.success("保存成功！"); time.sleep(1); st.rerun()
-                else: st.error("保存失败")
+            st.caption("按条件筛选后修改下方表格，点击保存同步当前页至数据库。")
+            projects, statuses = load_unit_filter_options()
+            c1, c2, c3 = st.columns(3)
+            f_proj = c1.selectbox("项目", ["全部"] + projects)
+            f_bld = c2.text_input("楼栋 (房号前缀，如 1)").strip()
+            f_stat = c3.selectbox("状态", ["全部"] + statuses)
+            clauses, params = build_unit_filters(
+                project=None if f_proj == "全部" else f_proj,
+                building=f_bld or None,
+                status=None if f_stat == "全部" else f_stat)
+            master_page_editor("master_units", "room_id", clauses, params, "ed_u", "💾 保存房间档案")
         with t2:
             st.caption("定义费项、单价及公式。")
-            df_fees = pd.read_sql("SELECT * FROM master_fees", conn)
-            edited_fees = st.data_editor(df_fees, num_rows="dynamic", use_container_width=True, key="ed_f")
-            if st.button("💾 保存收费标准"):
-                if save_master_data("master_fees", edited_fees, "fee_code"):
-                    st.success("保存成功！"); time.sleep(1); st.rerun()
-                else: st.error("保存失败")
-        conn.close()
+            master_page_editor("master_fees", "fee_code", [], [], "ed_f", "💾 保存收费标准")
 
     elif nav == "📥 数据导入":
         st.title("📥 历史数据导入")
@@ -611,7 +835,7 @@ def main():
                 df_raw = smart_read_excel(f)
                 if df_raw is not None:
                     ok, msg = process_import_sql(df_raw, user)
-                    if ok: st.success(msg); db_log(user, "数据导入", f"文件: {f.name}")
+                    if ok: st.success(msg); db_log(user, "数据导入", f"文件: {f.name}"); load_unit_filter_options.clear()
                     else: st.error(f"导入失败: {msg}")
                 else: st.error("文件读取失败")
 
@@ -655,8 +879,8 @@ def main():
                     n_b = bal + to_decimal(v)
                     cursor.execute("INSERT OR REPLACE INTO wallet (room_id, balance, last_updated) VALUES (?,?,?)", 
                                    (q_r, str(n_b), datetime.datetime.now().strftime("%Y-%m-%d")))
-                    cursor.execute("INSERT INTO trans_log (trans_id, room_id, trans_type, amount, operator) VALUES (?,?,?,?,?)",
-                                   (uuid.uuid4().hex[:8], q_r, "充值", str(v), user))
+                    cursor.execute("INSERT INTO trans_log (trans_id, trans_time, room_id, trans_type, amount, operator) VALUES (?,?,?,?,?,?)",
+                                   (uuid.uuid4().hex[:8], datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), q_r, "充值", str(v), user))
                     conn.commit()
                     st.success("OK"); time.sleep(1); st.rerun()
             with t2:
@@ -686,11 +910,49 @@ def main():
                 else: st.info("无欠费")
             conn.close()
 
+    # [Archive] 冷热分离与历史查询
+    elif nav == "🗄️ 历史归档":
+        st.title("🗄️ 历史数据归档")
+        t1, t2 = st.tabs(["📦 执行归档", "🔎 历史查询/导出"])
+        with t1:
+            st.caption(f"将截止日期前的已缴/已结清账单、资金流水与审计日志分批迁入归档库 `{ARCHIVE_DB_FILE}`，看板与 BI 合计保持不变。")
+            if role not in ["管理员", "财务总监"]:
+                st.error("您没有归档权限")
+            else:
+                cutoff = st.date_input("归档截止日期 (不含)", datetime.date.today() - datetime.timedelta(days=ARCHIVE_KEEP_DAYS))
+                if st.button("🚀 开始归档"):
+                    with st.spinner("归档中，收银可正常进行..."):
+                        ok, msg = process_archive_history(cutoff, user)
+                    if ok: st.success(msg)
+                    else: st.error(f"归档失败: {msg}")
+        with t2:
+            h_room = st.text_input("房号", "1-101", key="h_room")
+            if h_room:
+                conn = get_archive_connection()
+                df_h_led = pd.read_sql("SELECT * FROM ledger_all WHERE room_id=? ORDER BY charge_date", conn, params=(h_room,))
+                df_h_trans = pd.read_sql("SELECT * FROM trans_log_all WHERE room_id=? ORDER BY trans_time", conn, params=(h_room,))
+                conn.close()
+                st.subheader("📜 全部账单 (含归档)")
+                st.dataframe(df_h_led, use_container_width=True)
+                st.download_button("⬇️ 导出账单 CSV", df_h_led.to_csv(index=False).encode('utf-8-sig'), f"ledger_{h_room}.csv", "text/csv")
+                st.subheader("💳 全部流水 (含归档)")
+                st.dataframe(df_h_trans, use_container_width=True)
+                st.download_button("⬇️ 导出流水 CSV", df_h_trans.to_csv(index=False).encode('utf-8-sig'), f"trans_{h_room}.csv", "text/csv")
+
     elif nav == "🛡️ 审计日志":
         st.title("🛡️ 操作日志")
-        conn = get_connection()
-        st.dataframe(pd.read_sql("SELECT * FROM audit_logs ORDER BY log_id DESC LIMIT 50", conn), use_container_width=True)
+        c1, c2, c3 = st.columns([1, 1, 1])
+        d_from = c1.date_input("起始日期", datetime.date.today() - datetime.timedelta(days=30))
+        d_to = c2.date_input("截止日期", datetime.date.today())
+        with_arch = c3.checkbox("包含已归档日志")
+        conn = get_archive_connection() if with_arch else get_connection()
+        src = "audit_logs_all" if with_arch else "audit_logs"
+        df_logs = pd.read_sql(f"SELECT * FROM {src} WHERE log_time >= ? AND log_time < ? ORDER BY log_time DESC, log_id DESC",
+                              conn, params=(str(d_from), str(d_to + datetime.timedelta(days=1))))
         conn.close()
+        st.caption(f"共 {len(df_logs)} 条")
+        st.dataframe(df_logs, use_container_width=True)
+        st.download_button("⬇️ 导出日志 CSV", df_logs.to_csv(index=False).encode('utf-8-sig'), f"audit_logs_{d_from}_{d_to}.csv", "text/csv")
 
 if __name__ == "__main__":
     main()